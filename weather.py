@@ -1,57 +1,164 @@
 import serial
-import csv
 import time
 import os
+import threading
+from collections import deque
+import numpy as np
 from PySide6.QtWidgets import (QMainWindow, QWidget, QVBoxLayout, QHBoxLayout,
                                QLabel, QPushButton, QMessageBox, QFrame)
-from PySide6.QtCore import QThread, Signal, Slot, Qt
+from PySide6.QtCore import QThread, QTimer, Signal, Slot, Qt
 from PySide6.QtGui import QPainter, QColor, QPen, QFont
 
+# fdatasync skips metadata updates but is not available on Windows/macOS
+_fdatasync = getattr(os, 'fdatasync', os.fsync)
+
 
 class ArduinoInterface(QThread):
     '''
     Class to interface directly with the Arduino to continuously
     extract BME280 data.
+
+    Samples are written in place into a preallocated ring buffer, overwriting
+    the oldest entries when full. The display is notified once per batch of up
+    to `packetsize` samples, or as soon as no more data is waiting on the port,
+    with only the newest sample. While a sink is attached with `set_sink`
+    (e.g. a CsvWriter's rows), every sample is also appended to it as a
+    formatted csv line, bypassing the Qt event loop.
+
+    Parameters
+    ==========
+    port : str
+        Port that the Arduino of interest is set to.
+    baud : int
+        The Arduino device communication speed.
+    ring_size : int
+        Number of samples kept in the ring buffer. Default is 4096.
+    packetsize : int
+        Maximum number of samples emitted per batch. Default is 16.
     '''
-    data_received = Signal(list) 
+    data_received = Signal(str, object) # time, newest [temp, hum, pres] row
     error_occurred = Signal(str)
 
-    def __init__(self, port, baud):
+    def __init__(self, port, baud, ring_size=4096, packetsize=16):
         super().__init__()
         self.port = port
         self.baud = baud
         self.running = True
         self.ser = None
+        self.packetsize = packetsize
+        self.sink = None
+        self._sink_lock = threading.Lock()
+        self._last_sec = 0
+        self._last_ts = ''
+
+        # ring buffer of [temp, hum, pres] per sample
+        self.ring = np.empty((ring_size, 3), dtype=np.float32)
+        self.head = 0
 
     def run(self):
         try:
-            self.ser = serial.Serial(self.port, self.baud, timeout=2)
-            time.sleep(2) # let arduino reboot
+            # short timeout so reads block without stalling stop()
+            self.ser = serial.Serial(self.port, self.baud, timeout=0.05)
+            received = self._wait_ready() # let arduino reboot
         except Exception as e:
+            # the handshake can fail after the port opened, so release it
+            if self.ser and self.ser.is_open:
+                self.ser.close()
             self.error_occurred.emit(str(e))
             return
 
+        # ask the driver to deliver bytes immediately (e.g. FTDI latency timer)
+        try:
+            self.ser.set_low_latency_mode(True)
+        except (AttributeError, NotImplementedError, ValueError, OSError):
+            pass # not supported on this platform/driver
+
+        buf = received # trailing partial line carried between reads
+        start, count = self.head, 0 # samples waiting to be emitted
         while self.running:
             try:
-                if self.ser.in_waiting:
-                    line = self.ser.readline().decode('utf-8', errors='ignore').strip()
-                    parts = line.split(',')
-                    if len(parts) == 4:
-                        # validate data is numeric before emitting
-                        try:
-                            # [status, temp, hum, pres]
-                            clean_data = [parts[0], float(parts[1]), float(parts[2]), float(parts[3])]
-                            self.data_received.emit(clean_data)
-                        except ValueError:
-                            bad_data = [parts[0], -1, -1, -1]
-                            self.data_received.emit(bad_data)
-            except Exception:
-                pass
-            time.sleep(0.01) # prevent CPU hogging
+                # take everything already buffered, or block briefly for 1 byte
+                buf += self.ser.read(self.ser.in_waiting or 1)
+                waiting = self.ser.in_waiting
+            except (serial.SerialException, OSError) as e:
+                # port is gone (e.g. cable unplugged), stop instead of spinning
+                self.error_occurred.emit(str(e))
+                break
+            lines = buf.split(b'\n')
+            buf = lines[-1]
+            for line in lines[:-1]:
+                # split and convert the raw bytes directly, float() accepts bytes
+                parts = line.strip().split(b',')
+                if len(parts) != 4:
+                    continue
+                # [status, temp, hum, pres]
+                idx = self.head
+                # validate data is numeric before storing
+                try:
+                    temp, hum, pres = float(parts[1]), float(parts[2]), float(parts[3])
+                except ValueError:
+                    temp = hum = pres = -1.0
+                self.ring[idx] = (temp, hum, pres)
+                self.head = (idx + 1) % len(self.ring)
+                if self.sink is not None:
+                    # format the csv line here so no row container is built
+                    row = f"{self._timestamp()},{temp:.2f},{hum:.2f},{pres:.2f}\n"
+                    with self._sink_lock:
+                        if self.sink is not None:
+                            self.sink.append(row)
+                count += 1
+                if count >= self.packetsize:
+                    self._emit_batch(start, count)
+                    start, count = self.head, 0
+            # emit the rest once the port has been drained
+            if count and not waiting:
+                self._emit_batch(start, count)
+                start, count = self.head, 0
 
         if self.ser and self.ser.is_open:
             self.ser.close()
 
+    def _wait_ready(self, timeout=2.0):
+        # opening the port resets the arduino, so ping it until the sketch
+        # answers rather than always waiting out the full reboot time.
+        # returns everything received so no data lines are lost, the READY
+        # line itself is skipped by the parser like any non-data line
+        buf = bytearray()
+        deadline = time.monotonic() + timeout
+        next_ping = 0
+        while self.running and time.monotonic() < deadline:
+            # re-send the ping in case it was lost while the bootloader ran,
+            # but stop once the sketch is talking so older sketches, which
+            # read one command per reading, aren't left with queued pings
+            if not buf and time.monotonic() >= next_ping:
+                self.ser.write(b'?')
+                next_ping = time.monotonic() + 0.5
+            buf += self.ser.read(self.ser.in_waiting or 1)
+            if b'READY' in buf:
+                break
+        return buf # older sketches never reply, so just carry on
+
+    def _emit_batch(self, start, count):
+        # the display only needs the newest row of the batch
+        newest = self.ring[(start + count - 1) % len(self.ring)].copy()
+        self.data_received.emit(self._timestamp(), newest)
+
+    def _timestamp(self):
+        # timestamp only changes once per second, so reformat only then
+        sec = int(time.time())
+        if sec != self._last_sec:
+            self._last_ts = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(sec))
+            self._last_sec = sec
+        return self._last_ts
+
+    def set_sink(self, sink):
+        # once this returns, no further rows are appended to the old sink
+        with self._sink_lock:
+            self.sink = sink
+
+    def set_packetsize(self, packetsize):
+        self.packetsize = max(1, int(packetsize))
+
     def send_command(self, command):
         if self.ser and self.ser.is_open:
             self.ser.write(command.encode())
@@ -61,6 +168,118 @@ class ArduinoInterface(QThread):
         self.wait()
 
 
+class CsvWriter(QThread):
+    '''
+    Class to write recorded data to a csv file from its own thread,
+    so that disk I/O never blocks the GUI.
+
+    Parameters
+    ==========
+    filepath : str
+        Path of the csv file to create. The header row is written on creation.
+    maxsize : int
+        Maximum number of formatted lines waiting in `rows` to be written. When
+        full, the oldest line is dropped so the newest data is kept. Default is 10000.
+    batch_size : int
+        Maximum number of rows written to disk per batch. Default is 200.
+    flush_every : int
+        Number of rows after which the file is forced to disk, bounding how
+        much data a crash can lose. Default is 100.
+    flush_interval : float
+        Maximum seconds between forced writes to disk while rows are pending,
+        whichever of this and `flush_every` comes first. Default is 10.
+    max_delay : float
+        Maximum seconds written rows are held in the file buffer before being
+        handed to the OS, bounding what an app crash can lose. Default is 1.
+    '''
+    error_occurred = Signal(str)
+
+    def __init__(self, filepath, maxsize=10000, batch_size=200, flush_every=100, flush_interval=10.0,
+                 max_delay=1.0):
+        super().__init__()
+        self.rows = deque(maxlen=maxsize) # appended to by the producer thread
+        self.batch_size = batch_size
+        self.flush_every = flush_every
+        self.flush_interval = flush_interval
+        self.max_delay = max_delay
+        self.running = True
+        self._unsynced = 0 # rows written since the last sync to disk
+        self._unflushed = False # rows still in the file buffer
+        self._last_sync = time.monotonic()
+        self._last_flush = self._last_sync
+        self.csv_file = open(filepath, 'wb', buffering=1<<16)
+        try:
+            self.csv_file.write(b"Timestamp,Temperature_C,Humidity_Pct,Pressure_hPa\n")
+        except Exception:
+            self.csv_file.close()
+            raise
+
+    def run(self):
+        failed = False
+        try:
+            while self.running:
+                rows = self._drain()
+                if rows:
+                    self._write_rows(rows)
+                now = time.monotonic()
+                if self._unsynced and (self._unsynced >= self.flush_every or
+                                       now - self._last_sync >= self.flush_interval):
+                    self._sync()
+                elif self._unflushed and now - self._last_flush >= self.max_delay:
+                    self._flush()
+                if len(rows) < self.batch_size:
+                    time.sleep(0.05) # wait for more rows to accumulate
+
+            # write anything left over and force it to disk before closing
+            rows = self._drain()
+            while rows:
+                self._write_rows(rows)
+                rows = self._drain()
+            self._sync()
+        except OSError as e:
+            # e.g. disk full or drive removed, report it so the recording is stopped
+            failed = True
+            self.error_occurred.emit(f"Could not write to file: {e}")
+        finally:
+            # close() flushes any buffered rows, so it can fail the same way
+            try:
+                self.csv_file.close()
+            except OSError as e:
+                if not failed:
+                    self.error_occurred.emit(f"Could not write to file: {e}")
+
+    def _write_rows(self, rows):
+        # rows arrive already formatted, so write the whole batch in one call
+        self.csv_file.write(''.join(rows).encode('ascii'))
+        self._unsynced += len(rows)
+        self._unflushed = True
+
+    def _flush(self):
+        self.csv_file.flush()
+        self._unflushed = False
+        self._last_flush = time.monotonic()
+
+    def _sync(self):
+        self._flush()
+        _fdatasync(self.csv_file.fileno())
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+
+    def _drain(self):
+        # deque append/popleft are atomic, so no lock is needed
+        rows = []
+        try:
+            while len(rows) < self.batch_size:
+                rows.append(self.rows.popleft())
+        except IndexError:
+            pass
+        return rows
+
+    def stop(self):
+        self.running = False
+        self.wait()
+
+
 class LinearGauge(QWidget):
     '''
     Custom widget that draws a 3-segment color bar
@@ -87,10 +306,36 @@ class LinearGauge(QWidget):
         self.setMinimumHeight(30)
         self.setMinimumWidth(200)
         self.colors = colors
+        self._colors_q = [QColor(c) for c in self.colors]
+        self._pen = QPen(QColor(0,0,0))
+        self._pen.setWidth(3)
+        self._cache_geometry()
+
+    def _cache_geometry(self):
+        # pixel positions only change when the widget is resized
+        min_val = self.cfg['min']
+        max_val = self.cfg['max']
+        self._scale = self.width() / (max_val - min_val)
+        self._x_low = self._val_to_px(self.cfg['low'])
+        self._x_high = self._val_to_px(self.cfg['high'])
+        self._last_px = self._val_to_px(self.value)
+
+    def _val_to_px(self, v):
+        min_val = self.cfg['min']
+        v = max(min_val, min(self.cfg['max'], v))
+        return int((v - min_val) * self._scale)
 
     def set_value(self, val):
         self.value = val
-        self.update()
+        # only repaint when the pin would actually move
+        new_px = self._val_to_px(val)
+        if new_px != self._last_px:
+            self._last_px = new_px
+            self.update()
+
+    def resizeEvent(self, event):
+        self._cache_geometry()
+        super().resizeEvent(event)
 
     def paintEvent(self, event):
         painter = QPainter(self)
@@ -98,33 +343,17 @@ class LinearGauge(QWidget):
         
         w = self.width()
         h = self.height()
-        
-        # set ranges
-        min_val = self.cfg['min']
-        max_val = self.cfg['max']
-        low_thresh = self.cfg['low']
-        high_thresh = self.cfg['high']
-        total_range = max_val - min_val
-
-        # helper func to map value to pixels
-        def val_to_px(v):
-            if v < min_val: v = min_val
-            if v > max_val: v = max_val
-            return int((v - min_val) / total_range * w)
-
-        x_low = val_to_px(low_thresh)
-        x_high = val_to_px(high_thresh)
+        x_low = self._x_low
+        x_high = self._x_high
 
         # draw 3 zones
-        painter.fillRect(0, 5, x_low, h-10, QColor(self.colors[0]))
-        painter.fillRect(x_low, 5, x_high - x_low, h-10, QColor(self.colors[1]))
-        painter.fillRect(x_high, 5, w - x_high, h-10, QColor(self.colors[2]))
+        painter.fillRect(0, 5, x_low, h-10, self._colors_q[0])
+        painter.fillRect(x_low, 5, x_high - x_low, h-10, self._colors_q[1])
+        painter.fillRect(x_high, 5, w - x_high, h-10, self._colors_q[2])
         
         # set pin at current value
-        pin_x = val_to_px(self.value)
-        pen = QPen(QColor(0,0,0))
-        pen.setWidth(3)
-        painter.setPen(pen)
+        pin_x = self._last_px
+        painter.setPen(self._pen)
         painter.drawLine(pin_x, 0, pin_x, h)
 
 
@@ -162,15 +391,15 @@ class WeatherGUI(QMainWindow):
         self.recording_path = recording_path
         self.config = config
         self.recording = False
-        self.csv_file = None
-        self.csv_writer = None
+        self.csv_thread = None
+        self.flush_every = 100 # recorded rows between forced writes to disk
+        self._latest = None # most recent (time, data) not yet shown on display
         
         self.serial_port = serial_port
         self.baud_rate = baud_rate
         self.colors = colors
         
-        if not os.path.exists(self.recording_path):
-            os.makedirs(self.recording_path)
+        os.makedirs(self.recording_path, exist_ok=True)
 
         self.setWindowTitle("Homecage Weather Sensor")
         self.resize(600, 450)
@@ -182,6 +411,10 @@ class WeatherGUI(QMainWindow):
         self.worker.start()
 
     def setup_ui(self):
+        # build fonts once and share them, each QFont(...) does a font lookup
+        self._title_font = QFont("Arial", 14, QFont.Bold)
+        self._small_font = QFont('Arial', 10)
+
         central_widget = QWidget()
         self.setCentralWidget(central_widget)
         main_layout = QVBoxLayout(central_widget)
@@ -189,7 +422,7 @@ class WeatherGUI(QMainWindow):
         # draw recording status
         self.status_label = QLabel("Not Recording")
         self.status_label.setAlignment(Qt.AlignCenter)
-        self.status_label.setFont(QFont("Arial", 14, QFont.Bold))
+        self.status_label.setFont(self._title_font)
         main_layout.addWidget(self.status_label)
 
         # add legend
@@ -205,6 +438,7 @@ class WeatherGUI(QMainWindow):
         # for each data, draw label, gauge, and value
         self.gauges = {}
         self.value_labels = {}
+        self._val_fmt = {}
         for key in ['temp', 'hum', 'pres']:
             row_layout = QHBoxLayout()
             cfg = self.config[key]
@@ -231,10 +465,10 @@ class WeatherGUI(QMainWindow):
 
             min_lbl = QLabel(f"{cfg['min']}-")
             min_lbl.setAlignment(Qt.AlignLeft)
-            min_lbl.setFont(QFont('Arial', 10))
+            min_lbl.setFont(self._small_font)
             max_lbl = QLabel(f"{cfg['max']}+")
             max_lbl.setAlignment(Qt.AlignRight)
-            max_lbl.setFont(QFont('Arial', 10))
+            max_lbl.setFont(self._small_font)
 
             labels_layout.addWidget(min_lbl)
             labels_layout.addStretch()
@@ -246,6 +480,7 @@ class WeatherGUI(QMainWindow):
             lbl_val.setFixedWidth(100)
             lbl_val.setAlignment(Qt.AlignRight | Qt.AlignVCenter)
             self.value_labels[key] = lbl_val
+            self._val_fmt[key] = "{:.2f} " + cfg['unit']
 
             # add everything to main layout
             row_layout.addWidget(lbl_name)
@@ -257,6 +492,11 @@ class WeatherGUI(QMainWindow):
             frame.setFrameShape(QFrame.StyledPanel)
             main_layout.addWidget(frame)
         
+        # (gauge, value label, format) per data type, in [temp, hum, pres] order
+        self._rows = tuple((self.gauges[key], self.value_labels[key], self._val_fmt[key])
+                           for key in ['temp', 'hum', 'pres'])
+        self._last_text = [lbl.text() for _, lbl, _ in self._rows]
+
         # draw timestamp
         self.lbl_time = QLabel("Time: --")
         self.lbl_time.setAlignment(Qt.AlignCenter)
@@ -274,62 +514,85 @@ class WeatherGUI(QMainWindow):
         btn_layout.addWidget(self.stop_btn)
         main_layout.addLayout(btn_layout)
 
-    @Slot(list)
-    def update_display(self, data):
-        # data are in format [status, temp, hum, pres]
-        current_time = time.strftime('%Y-%m-%d %H:%M:%S')
-        self.lbl_time.setText(f'Time: {current_time}')
-        values = {'temp': data[1], 'hum': data[2], 'pres': data[3]}
+        # refresh the display at ~30Hz regardless of the incoming sample rate
+        self.refresh_timer = QTimer(self)
+        self.refresh_timer.setInterval(33)
+        self.refresh_timer.timeout.connect(self._refresh_ui)
+        self.refresh_timer.start()
 
-        # update values on display
-        for key, val in values.items():
-            self.gauges[key].set_value(val)
-            unit = self.config[key]['unit']
-            self.value_labels[key].setText(f"{val:.2f} {unit}")
+    @Slot(str, object)
+    def update_display(self, current_time, data):
+        # data are in format [temp, hum, pres], recorded rows bypass the GUI
+        # keep only the latest sample for the display, drawn by _refresh_ui
+        self._latest = (current_time, data)
+
+    def _refresh_ui(self):
+        if self._latest is None:
+            return
+        current_time, data = self._latest
+        self._latest = None
 
-        # save if recording
-        if self.recording and self.csv_writer:
-            self.csv_writer.writerow([current_time, data[1], data[2], data[3]])
+        self.lbl_time.setText('Time: ' + current_time)
+
+        # update values on display, only resetting text that changed
+        last_text = self._last_text
+        for i, ((gauge, lbl, fmt), val) in enumerate(zip(self._rows, data)):
+            gauge.set_value(val)
+            text = fmt.format(val)
+            if text != last_text[i]:
+                lbl.setText(text)
+                last_text[i] = text
 
     def start_recording(self):
+        if self.recording:
+            return
         filename = f"{time.strftime('%Y%m%d_%H%M%S')}_weather.csv"
         filepath = os.path.join(self.recording_path, filename)
-        if not os.path.exists(os.path.dirname(filepath)):
-            os.make_dirs(os.path.dirname(filepath))
-        
+
         try:
-            self.csv_file = open(filepath, 'w', newline='')
-            self.csv_writer = csv.writer(self.csv_file)
-            self.csv_writer.writerow(["Timestamp", "Temperature_C", "Humidity_Pct", "Pressure_hPa"])
+            self.csv_thread = CsvWriter(filepath, flush_every=self.flush_every)
         except Exception as e:
             self.show_error(f"Could not create file: {e}")
             return
+        self.csv_thread.error_occurred.connect(self.stop_recording)
+        self.csv_thread.error_occurred.connect(self.show_error)
+        self.csv_thread.start()
+        self.worker.set_sink(self.csv_thread.rows)
 
         self.worker.send_command('1')
         self.recording = True
         self.status_label.setText(f"Recording to: {filename}")
         self.status_label.setStyleSheet("color: red;")
-        self.btn_record.setEnabled(False)
-        self.btn_stop.setEnabled(True)
+        self.record_btn.setEnabled(False)
+        self.stop_btn.setEnabled(True)
 
     def stop_recording(self):
+        if not self.recording:
+            return
         self.worker.send_command('0')
-        if self.csv_file:
-            self.csv_file.close()
-            self.csv_file = None
-            self.csv_writer = None
+        self.worker.set_sink(None) # detach before the writer's final drain
+        if self.csv_thread:
+            self.csv_thread.stop()
+            self.csv_thread = None
 
         self.recording = False
         self.status_label.setText("Not Recording")
         self.status_label.setStyleSheet("color: white;")
-        self.btn_record.setEnabled(True)
-        self.btn_stop.setEnabled(False)
+        self.record_btn.setEnabled(True)
+        self.stop_btn.setEnabled(False)
+
+    @Slot(int)
+    def set_decimation(self, n):
+        # force recorded data to disk every n rows, trading throughput for durability
+        self.flush_every = max(1, int(n))
+        if self.csv_thread:
+            self.csv_thread.flush_every = self.flush_every
 
     def show_error(self, message):
         QMessageBox.critical(self, "Error", message)
 
     def closeEvent(self, event):
         self.worker.stop()
-        if self.csv_file:
-            self.csv_file.close()
+        if self.csv_thread:
+            self.csv_thread.stop()
         event.accept()
\ No newline at end of file
@@ -22,12 +22,14 @@ void setup() {
 
 void loop() {
   // start recording when signal is sent
-  if (Serial.available() > 0) {
+  while (Serial.available() > 0) {
     char command = Serial.read();
     if (command == '1') {
       isRecording = true;
     } else if (command == '0') {
       isRecording = false;
+    } else if (command == '?') {
+      Serial.println("READY"); // reply to the GUI's readiness ping
     }
   }
 